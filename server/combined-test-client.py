@@ -10,24 +10,25 @@ Bulletproof Raspberry Pi Client for Xeryon Demo Station
 import asyncio
 import websockets
 import json
-import base64
-from concurrent.futures import ThreadPoolExecutor
+import struct
 import cv2
 import time
+import functools
 import sys
 import os
 import random
 import logging
+import logging.handlers
 import gc
-import subprocess
-from datetime import datetime
-from collections import deque
+import queue
 import threading
 import signal
 
 # Will be imported on the actual RPi
 try:
-    from picamera2 import Picamera2
+    from picamera2 import Picamera2, MappedArray
+    from picamera2.encoders import MJPEGEncoder, Quality
+    from picamera2.outputs import FileOutput
     from websockets.exceptions import ConnectionClosed
     import serial
     sys.path.append('/home/pi/Desktop/RemoteDemoStation/BasicServer/Python')
@@ -42,46 +43,107 @@ except ImportError:
 
     logging.warning("Running in simulation mode (not on RPi)")
 
+# libjpeg-turbo encoder (NEON-accelerated on the Pi), falls back to cv2.imencode
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420, TJFLAG_FASTDCT
+    tj = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    tj = None
+
+# libjpeg-turbo for packed BGR frames (simplejpeg), falls back to cv2.imencode
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+# libuv-based event loop for the websocket/asyncio hot paths, stock asyncio otherwise
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+# Rust JSON codec when installed; dumps stays str so messages go out as text frames
+# (binary frames are reserved for camera data)
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+except ImportError:
+    json_dumps = json.dumps
+    json_loads = json.loads
+
 # ===== CONFIGURATION =====
 STATION_ID = "RPI1"
-SERVER_URL = f"ws://localhost:5000/rpi/{STATION_ID}"  
+SERVER_URL = f"ws://localhost:5000/rpi/{STATION_ID}"  # permessage-deflate is off: frames are pre-compressed JPEG
 RESOLUTION_WIDTH = 1280
 RESOLUTION_HEIGHT = 720
 JPEG_QUALITY = 70
 TARGET_FPS = 25
+FRAME_PERIOD = 1.0 / TARGET_FPS
 COM_PORT = "/dev/ttyACM0"
 EPOS_UPDATE_INTERVAL = 0.05  # 50ms position update interval
 COMMAND_TIMEOUT = 60
+HARDWARE_JPEG = True  # Encode on the Pi's V4L2 MJPEG block instead of in Python (falls back if absent)
 
 # Default parameters
 DEFAULT_ACCELERATION = 32750
 DEFAULT_DECELERATION = 32750 
 DEFAULT_SPEED = 500
-MIN_SLEEP_DELAY = 0.00001
 
 # Connection parameters
 MAX_RECONNECT_ATTEMPTS = 9999
 RECONNECT_BASE_DELAY = 0.5
 MAX_RECONNECT_DELAY = 5.0
+RECONNECT_JITTER = 0.3  # Up to 30% off each delay so stations don't reconnect in lockstep
 MAX_CONNECTION_TIMEOUT = 3.0
 MAX_CLOSE_TIMEOUT = 1.0
 CONNECTION_HEARTBEAT_INTERVAL = 5.0
 
+# Baseline, single-pass JPEG: Huffman optimization and progressive mode both add scalar passes
+JPEG_ENCODE_PARAMS = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY,
+                      cv2.IMWRITE_JPEG_OPTIMIZE, 0,
+                      cv2.IMWRITE_JPEG_PROGRESSIVE, 0]
+
+# Binary camera frame header: station id, frame number, epoch timestamp (ms), followed by the JPEG bytes.
+# Frame number and timestamp are uint32 and wrap modulo 2**32
+FRAME_HEADER = struct.Struct("<4sII")
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+STATION_ID_BYTES = STATION_ID.encode("ascii")[:4].ljust(4, b"\0")
+FRAME_BUFFER_SIZE = 256 * 1024  # Initial send buffer, grown if a JPEG ever outsizes it
+
+# Binary position report: opcode, sequence number, epoch timestamp (ms), position (mm).
+# The opcode byte is below any ASCII station id, which is how the server tells it apart from frames
+POSITION_MESSAGE = struct.Struct("<BIId")
+POSITION_MESSAGE_OPCODE = 0x10
+
+# Pre-serialized JSON for the periodic messages; only the values change (timestamps are epoch ms)
+PING_MESSAGE_TEMPLATE = '{{"type":"ping","timestamp":{timestamp}}}'
+# Positions from this client are simulated (see send_position_update), so the server must not record them
+REGISTRATION_MESSAGE = json.dumps({"type": "register", "connectionType": "combined", "simulatedPosition": True})
+
 # ===== GLOBAL STATE =====
 shutdown_requested = False
+hardware_jpeg = HARDWARE_JPEG  # Cleared for the rest of the run if the MJPEG encoder fails to start
 controller = None
 axis = None
 picam2 = None
 demo_running = False
-command_queue = asyncio.Queue()
 last_successful_command_time = time.time()
 last_successful_frame_time = time.time()
 last_ping_response_time = time.time()
 startup_time = None
+frame_count = 0
+position_count = 0
+position_buffer = bytearray(POSITION_MESSAGE.size)
+latest_frame = None  # Newest encoded JPEG from the camera thread, None once sent
+frame_ready = asyncio.Event()
+frame_buffer = bytearray(FRAME_BUFFER_SIZE)  # Header + JPEG are assembled here for every send
+frame_loop = None  # Event loop the camera threads signal frame_ready on
 
 # Tracking variables
-position_lock = threading.Lock()
-current_position = 0.0
 thermal_error_count = 0
 amplifier_error_count = 0
 serial_error_count = 0
@@ -92,81 +154,193 @@ total_connection_failures = 0
 reconnect_delay = RECONNECT_BASE_DELAY
 
 # ===== LOGGING SETUP =====
-logging.basicConfig(level=logging.DEBUG,
-                   format='%(asctime)s - %(levelname)s - %(message)s',
-                   handlers=[
-                       logging.StreamHandler(),
-                       logging.FileHandler('/tmp/xeryon_client.log')
-                       if RUNNING_ON_RPI else logging.NullHandler()
-                   ])
+# Records are only queued on the calling thread; a listener thread formats them and does
+# the console/file I/O. Set XERYON_LOG_LEVEL=DEBUG for per-message logging.
+log_queue = queue.SimpleQueue()
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+log_handlers = [logging.StreamHandler()]
+if RUNNING_ON_RPI:
+    log_handlers.append(logging.FileHandler('/tmp/xeryon_client.log'))
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
+log_listener.start()
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))  # Final formatting happens in the listener
+requested_log_level = os.environ.get("XERYON_LOG_LEVEL", "INFO").upper()
+# An unknown level name must not keep the station from starting
+log_level = requested_log_level if requested_log_level in logging.getLevelNamesMapping() else "INFO"
+logging.basicConfig(level=log_level,
+                   handlers=[queue_handler],
+                   force=True)  # Replace the default handler the simulation-mode warning installed
 logger = logging.getLogger("XeryonClient")
-jpeg_executor = ThreadPoolExecutor(max_workers=2)
+if log_level != requested_log_level:
+    logger.warning("Unknown XERYON_LOG_LEVEL %r, using INFO", requested_log_level)
+
+def encode_camera_frame(cap):
+    """Capture one frame and return it JPEG-encoded (None if the camera had nothing)"""
+    if RUNNING_ON_RPI:
+        # Encode straight out of the mapped camera buffer, then hand it back to the pipeline
+        request = cap.capture_request()
+        try:
+            with MappedArray(request, "main") as mapped:
+                if tj is not None:
+                    # Planar YUV420 straight from the ISP, no RGB->YCbCr pass before encoding
+                    return tj.encode_from_yuv(mapped.array, RESOLUTION_HEIGHT, RESOLUTION_WIDTH,
+                                              quality=JPEG_QUALITY, jpeg_subsample=TJSAMP_420,
+                                              flags=TJFLAG_FASTDCT)
+                return encode_jpeg(mapped.array)
+        finally:
+            request.release()
 
-async def send_camera_frame(websocket, cap):
     ret, frame = cap.read()
     if not ret:
+        return None
+
+    return encode_jpeg(frame)
+
+def encode_jpeg(frame):
+    """JPEG-encode a packed BGR frame"""
+    if simplejpeg is not None:
+        return simplejpeg.encode_jpeg(frame, quality=JPEG_QUALITY, colorspace='BGR',
+                                      colorsubsampling='420', fastdct=True)
+    if tj is not None:
+        return tj.encode(frame, quality=JPEG_QUALITY, pixel_format=TJPF_BGR,
+                         jpeg_subsample=TJSAMP_420, flags=TJFLAG_FASTDCT)
+
+    _, buffer = cv2.imencode('.jpg', frame, JPEG_ENCODE_PARAMS)
+    return buffer.tobytes()
+
+def put_latest_frame(jpeg):
+    """Hand a JPEG to the sender, replacing any frame it has not picked up yet"""
+    global latest_frame
+    latest_frame = jpeg
+    frame_loop.call_soon_threadsafe(frame_ready.set)
+
+class FrameSlotSink:
+    """File-like target for Picamera2's FileOutput; each write() is one complete JPEG"""
+
+    def write(self, buf):
+        put_latest_frame(bytes(buf))
+        return len(buf)
+
+    def flush(self):
+        pass
+
+def capture_loop(capture, stop_event):
+    """Capture + encode on a worker thread so the event loop is never blocked by the camera"""
+    next_deadline = time.monotonic()
+    while not shutdown_requested and not stop_event.is_set():
+        try:
+            jpeg = capture()
+        except Exception as e:
+            logger.error("Camera capture error: %s", e)
+            jpeg = None
+
+        if jpeg is not None:
+            put_latest_frame(jpeg)
+
+        # Fixed frame deadlines so pacing does not drift; skip ahead instead of bursting to catch up
+        next_deadline += FRAME_PERIOD
+        now = time.monotonic()
+        if now - next_deadline > 2 * FRAME_PERIOD:
+            next_deadline = now + FRAME_PERIOD
+        delay = next_deadline - now
+        if delay > 0:
+            time.sleep(delay)
+
+async def send_camera_frame(websocket):
+    global frame_count, latest_frame, frame_buffer
+
+    await frame_ready.wait()
+    frame_ready.clear()
+    jpeg, latest_frame = latest_frame, None
+    if jpeg is None:
         return
-    
-    # Encode frame as JPEG
-    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]) #Added JPEG quality
-    jpg_as_text = base64.b64encode(buffer).decode('utf-8')
-    
-    # Create frame message
-    frame_message = {
-        "type": "camera_frame",
-        "frame": f"data:image/jpeg;base64,{jpg_as_text}",
-        "timestamp": datetime.now().isoformat(),
-    }
-    
-    await websocket.send(json.dumps(frame_message))
+
+    frame_count += 1
+
+    # Send the JPEG as a single binary message with a small fixed header (no base64/JSON),
+    # built in place in the reusable buffer rather than concatenated into a new bytes object
+    size = FRAME_HEADER_SIZE + len(jpeg)
+    if size > len(frame_buffer):
+        frame_buffer = bytearray(size)
+    FRAME_HEADER.pack_into(frame_buffer, 0, STATION_ID_BYTES,
+                           frame_count & 0xFFFFFFFF,
+                           time.time_ns() // 1_000_000 & 0xFFFFFFFF)
+    frame_buffer[FRAME_HEADER_SIZE:size] = jpeg
+    # websockets frames the payload before send() returns, so the buffer is free again afterwards
+    await websocket.send(memoryview(frame_buffer)[:size])
 
 async def send_position_update(websocket):
+    global position_count
     # Simulate position data (oscillating between -100 and 100)
     import math #Import math here.
-    position = 100 * math.sin(time.time())
-    
-    position_message = {
-        "type": "position",
-        "position": position,
-        "timestamp": datetime.now().isoformat(),
-    }
-    
-    await websocket.send(json.dumps(position_message))
+    now = time.time()
+    position = 100 * math.sin(now)
+
+    position_count += 1
+    POSITION_MESSAGE.pack_into(position_buffer, 0, POSITION_MESSAGE_OPCODE,
+                               position_count & 0xFFFFFFFF,
+                               int(now * 1000) & 0xFFFFFFFF,
+                               position)
+    await websocket.send(position_buffer)
+
+async def camera_frame_loop(websocket):
+    while not shutdown_requested:
+        # Send the newest camera frame as soon as the capture thread has one
+        await send_camera_frame(websocket)
+
+    # Closing the socket ends the other tasks sharing this connection
+    await websocket.close()
+
+async def position_update_loop(websocket):
+    # Sends at the update rate itself rather than being polled from the frame loop
+    while True:
+        await send_position_update(websocket)
+        await asyncio.sleep(EPOS_UPDATE_INTERVAL)
 
 async def heartbeat(websocket):
     while True:
-        try:
-            ping_message = {
-                "type": "ping",
-                "timestamp": datetime.now().isoformat()
-            }
-            await websocket.send(json.dumps(ping_message))
-            await asyncio.sleep(1)
-        except:
-            break
+        await websocket.send(PING_MESSAGE_TEMPLATE.format(timestamp=int(time.time() * 1000)))
+        await asyncio.sleep(1)
 
 async def handle_messages(websocket):
     while True:
+        message = await websocket.recv()
+        # The server only sends JSON objects; skip anything else without running the parser
+        if message[:1] not in ("{", b"{"):
+            logger.debug("Ignoring non-JSON message: %r", message[:32])
+            continue
         try:
-            message = await websocket.recv()
-            data = json.loads(message)
-            print(f"Received message: {data}")
-            
-            # Handle command messages
-            if data.get("type") == "command":
-                response = {
-                    "type": "command_response",
-                    "status": "success",
-                    "command": data.get("command"),
-                    "timestamp": datetime.now().isoformat()
-                }
-                await websocket.send(json.dumps(response))
-        except Exception as e:
+            data = json_loads(message)
+        except ValueError as e:
             print(f"Error handling message: {e}")
-            break
+            continue
+        logger.debug("Received message: %s", data)
 
-async def main():
+        # Handle command messages
+        if data.get("type") == "command":
+            response = {
+                "type": "command_response",
+                "status": "success",
+                "command": data.get("command"),
+                "timestamp": time.time_ns() // 1_000_000  # Epoch ms, like the other messages
+            }
+            await websocket.send(json_dumps(response))
+
+async def wait_before_reconnect():
+    """Exponential backoff with a bounded random jitter between connection attempts"""
     global total_connection_failures, reconnect_delay
+    total_connection_failures = min(total_connection_failures + 1, MAX_RECONNECT_ATTEMPTS)
+    reconnect_delay = min(reconnect_delay * 2, MAX_RECONNECT_DELAY)
+    # Jitter shortens the wait, so it stays in effect once the delay sits at the cap
+    delay = reconnect_delay * (1.0 - RECONNECT_JITTER * random.random())
+    logger.info("Retrying in %.2f seconds...", delay)
+    await asyncio.sleep(delay)
+
+async def main():
+    global picam2, frame_loop, hardware_jpeg, reconnect_delay
     rpi_id = sys.argv[1] if len(sys.argv) > 1 else STATION_ID
     url = f"{SERVER_URL}"
     
@@ -175,84 +349,105 @@ async def main():
             break
         try:
             print(f"Connecting to {url}...")
-            async with websockets.connect(url, max_size=1024**3) as websocket: #Increased max_size.
+            # JPEG frames are already entropy-coded, so permessage-deflate would only burn CPU
+            async with websockets.connect(url, max_size=1024**3, compression=None,
+                                          write_limit=2**20) as websocket: #Increased max_size.
                 print("Connected!")
+                reconnect_delay = RECONNECT_BASE_DELAY  # Back off from scratch after the next disconnect
                 
                 # Send registration message
-                reg_message = {
-                    "type": "register",
-                    "connectionType": "combined"
-                }
-                await websocket.send(json.dumps(reg_message))
+                await websocket.send(REGISTRATION_MESSAGE)
                 
-                # Initialize camera
-                if RUNNING_ON_RPI:
+                # Initialize camera (its threads hand frames back to this loop)
+                frame_loop = asyncio.get_running_loop()
+                if RUNNING_ON_RPI and hardware_jpeg:
+                    # JPEGs come out of the camera pipeline already encoded, straight into latest_frame
+                    picam2 = Picamera2()
+                    try:
+                        picam2.configure(picam2.create_video_configuration(main={"size": (RESOLUTION_WIDTH, RESOLUTION_HEIGHT)}))
+                        # The V4L2 encoder is bitrate driven; Picamera2 derives the bitrate from a Quality level
+                        picam2.start_recording(MJPEGEncoder(), FileOutput(FrameSlotSink()),
+                                               quality=Quality(min(JPEG_QUALITY // 20, Quality.VERY_HIGH)))
+                    except Exception as e:
+                        # No V4L2 JPEG block (e.g. Pi 5): encode in software from here on
+                        logger.warning("Hardware MJPEG encoder unavailable, using software encoding: %s", e)
+                        hardware_jpeg = False
+                        picam2.close()
+                        picam2 = None
+                    capture = None
+                if RUNNING_ON_RPI and not hardware_jpeg:
                     picam2 = Picamera2()
-                    picam2.configure(picam2.create_preview_configuration(main={"format": 'RGB888', "size": (RESOLUTION_WIDTH, RESOLUTION_HEIGHT)}))
+                    # libcamera's RGB888 is B,G,R in memory - already what encode_jpeg expects, no cvtColor
+                    camera_format = 'YUV420' if tj is not None else 'RGB888'
+                    # Two buffers: one being filled while we encode the other, so nothing stale queues up
+                    picam2.configure(picam2.create_preview_configuration(main={"format": camera_format, "size": (RESOLUTION_WIDTH, RESOLUTION_HEIGHT)},
+                                                                         buffer_count=2))
                     picam2.start()
-                    cap = picam2
-                else:
+                    # Bind this connection's camera now; the global is cleared/replaced on reconnect
+                    capture = functools.partial(encode_camera_frame, picam2)
+                elif not RUNNING_ON_RPI:
                     cap = cv2.VideoCapture(0)
                     if not cap.isOpened():
                         cap = cv2.VideoCapture(-1)  # Try default camera
-                    if not cap.isOpened():
+                    if cap.isOpened():
+                        capture = functools.partial(encode_camera_frame, cap)
+                    else:
                         print("Warning: No camera available, will simulate camera feed")
                         import numpy as np #Import numpy here.
-                        # Create a black frame
-                        frame = np.zeros((RESOLUTION_HEIGHT, RESOLUTION_WIDTH, 3), np.uint8)
-                        cap = type('DummyCap', (), {
-                            'read': lambda self: (True, frame),
-                            'isOpened': lambda self: True
-                        })()
-                
-                # Start heartbeat
-                heartbeat_task = asyncio.create_task(heartbeat(websocket))
-                message_handler = asyncio.create_task(handle_messages(websocket))
+                        # A black frame never changes, so encode it once and resend the same JPEG
+                        dummy_jpeg = encode_jpeg(np.zeros((RESOLUTION_HEIGHT, RESOLUTION_WIDTH, 3), np.uint8))
+                        capture = lambda: dummy_jpeg
                 
-                last_frame_time = 0
-                last_position_time = 0
-                
-                while True:
-                    if shutdown_requested:
-                        break
-                    current_time = time.time()
-                    
-                    # Send camera frame if interval elapsed
-                    if current_time - last_frame_time >= 1.0/TARGET_FPS:
-                        await send_camera_frame(websocket, cap)
-                        last_frame_time = current_time
-                    
-                    # Send position update if interval elapsed
-                    if current_time - last_position_time >= EPOS_UPDATE_INTERVAL:
-                        await send_position_update(websocket)
-                        last_position_time = current_time
-                    
-                    await asyncio.sleep(MIN_SLEEP_DELAY)  # Small sleep to prevent CPU hogging
+                # Capture and encode frames off the event loop (unless the camera pipeline already does)
+                capture_stop = threading.Event()
+                capture_thread = None
+                if capture is not None:
+                    capture_thread = threading.Thread(target=capture_loop, args=(capture, capture_stop), daemon=True)
+                    capture_thread.start()
+
+                # A failure in any task (usually the socket closing) cancels the rest of the group
+                try:
+                    async with asyncio.TaskGroup() as tg:
+                        tg.create_task(camera_frame_loop(websocket))
+                        tg.create_task(position_update_loop(websocket))
+                        tg.create_task(heartbeat(websocket))
+                        await handle_messages(websocket)
+                except* websockets.exceptions.ConnectionClosed as eg:
+                    raise eg.exceptions[0]
+                finally:
+                    capture_stop.set()
+                    if capture_thread is not None:
+                        # The thread may be inside a mapped camera request; let it finish before closing
+                        await asyncio.to_thread(capture_thread.join)
+                    if RUNNING_ON_RPI and picam2:
+                        if capture is None:
+                            # Stop the encoder thread and FileOutput before the camera is reopened
+                            picam2.stop_recording()
+                        picam2.close()
+                        picam2 = None
                 
         except websockets.exceptions.ConnectionClosed as e:
+            # The frame loop closes the socket itself on SIGINT/SIGTERM; that is not a failure
+            if shutdown_requested:
+                break
             logger.error(f"Websocket connection closed: {e}")
-            total_connection_failures += 1
-            reconnect_delay = min(reconnect_delay * 2, MAX_RECONNECT_DELAY)  #Exponential backoff
-            logger.info(f"Retrying in {reconnect_delay} seconds...")
-            await asyncio.sleep(reconnect_delay)
+            await wait_before_reconnect()
 
         except Exception as e:
+            if shutdown_requested:
+                break
             print(f"Connection error: {e}")
             logger.exception(f"An unexpected error occurred: {e}")
-            total_connection_failures += 1
-            reconnect_delay = min(reconnect_delay * 2, MAX_RECONNECT_DELAY)  #Exponential backoff
-            logger.info(f"Retrying in {reconnect_delay} seconds...")
-            await asyncio.sleep(reconnect_delay)
-            
-
-    if RUNNING_ON_RPI and picam2:
-        picam2.stop()
+            await wait_before_reconnect()
 
 
 def signal_handler(sig, frame):
     global shutdown_requested
     logger.info("Shutdown signal received. Initiating graceful shutdown...")
     shutdown_requested = True
+    # Wake the frame loop in case it is waiting on a camera that has stopped
+    if frame_loop is not None:
+        frame_loop.call_soon_threadsafe(frame_ready.set)
 
 
 if __name__ == "__main__":
@@ -260,4 +455,11 @@ if __name__ == "__main__":
     import numpy as np
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
-    asyncio.run(main())
\ No newline at end of file
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    # Everything imported and set up so far lives for the whole run; keep it out of GC passes
+    gc.freeze()
+    try:
+        asyncio.run(main())
+    finally:
+        log_listener.stop()
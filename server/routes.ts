@@ -53,6 +53,7 @@ interface WebSocketRegistrationMessage {
   type: 'register';
   rpiId: string;
   connectionType?: 'camera' | 'control' | 'combined';
+  simulatedPosition?: boolean;  // Position reports are synthetic; forward them but keep them out of session logs
 }
 
 interface WebSocketCommandMessage {
@@ -66,6 +67,23 @@ interface WebSocketCommandMessage {
 
 type WebSocketMessage = WebSocketRegistrationMessage | WebSocketCommandMessage;
 
+// Binary camera frames from the RPi: little-endian header followed by raw JPEG bytes
+// [0..4) station id (ASCII, NUL padded), [4..8) frame number (uint32), [8..12) epoch timestamp ms (uint32)
+// Both counters are masked to 32 bits on the RPi, so they wrap modulo 2^32 rather than overflowing
+const FRAME_HEADER_SIZE = 12;
+
+// Binary position reports from the RPi, little-endian:
+// [0] opcode 0x10, [1..5) sequence number (uint32), [5..9) epoch timestamp ms (uint32), [9..17) position mm (float64)
+const POSITION_MESSAGE_OPCODE = 0x10;
+const POSITION_MESSAGE_SIZE = 17;
+
+// Optional limits on how often position reports touch the database (both off by default).
+// POSITION_RECORD_INTERVAL_MS drops recordings closer together than this; SESSION_LOOKUP_INTERVAL_MS
+// reuses the active-session lookup for this long, so positions at a session boundary may land
+// up to that much late/early. 0 records every report against a fresh lookup.
+const POSITION_RECORD_INTERVAL_MS = Number(process.env.POSITION_RECORD_INTERVAL_MS) || 0;
+const SESSION_LOOKUP_INTERVAL_MS = Number(process.env.SESSION_LOOKUP_INTERVAL_MS) || 0;
+
 
 export async function registerRoutes(app: Express): Promise<Server> {
   setupAuth(app);
@@ -214,8 +232,103 @@ export async function registerRoutes(app: Express): Promise<Server> {
       }
     }
 
-    ws.on("message", async function(data) {
+    // Forward a camera frame (as a data URL) to UI clients subscribed to this RPi's feed
+    const forwardCameraFrame = (frame: string, frameNumber?: number) => {
+      // Create the message once to avoid excessive string operations
+      const frameMessage = JSON.stringify({
+        type: "camera_frame",
+        rpiId,
+        frame,
+        frameNumber
+      });
+
+      for (const client of uiConnections.values()) {
+        if (client.ws.readyState === WebSocket.OPEN && client.rpiId === rpiId) {
+          try {
+            client.ws.send(frameMessage);
+          } catch (error) {
+            console.error(`[RPi ${rpiId}] Error sending frame:`, error);
+          }
+        }
+      }
+    };
+
+    // Test clients whose positions are simulated say so when registering; those are never recorded
+    let recordPositions = true;
+
+    // Active session for this RPi, reused for SESSION_LOOKUP_INTERVAL_MS when that is set
+    let activeSessionLogId: number | null = null;
+    let sessionCheckedAt = 0;
+    let positionRecordedAt = 0;
+
+    const getActiveSessionLogId = async () => {
+      const now = Date.now();
+      if (SESSION_LOOKUP_INTERVAL_MS === 0 || now - sessionCheckedAt >= SESSION_LOOKUP_INTERVAL_MS) {
+        sessionCheckedAt = now;
+        const stations = await storage.getStations();
+        const station = stations.find(s => s.rpiId === rpiId && s.status === "in_use");
+        activeSessionLogId = station?.currentSessionLogId ?? null;
+      }
+      return activeSessionLogId;
+    };
+
+    // Pass a position report on to this RPi's UI clients and record it for the active session
+    const handlePositionUpdate = async (epos: number) => {
+      // Forward position updates to relevant UI clients
+      for (const client of uiConnections.values()) {
+        if (client.ws.readyState === WebSocket.OPEN && client.rpiId === rpiId) {
+          client.ws.send(JSON.stringify({
+            type: 'position_update',
+            rpiId: rpiId,
+            epos
+          }));
+        }
+      }
+
+      const now = Date.now();
+      if (!recordPositions || now - positionRecordedAt < POSITION_RECORD_INTERVAL_MS) {
+        return;
+      }
+      positionRecordedAt = now;
+
+      // Record position in database if there's an active session
       try {
+        const sessionLogId = await getActiveSessionLogId();
+        if (sessionLogId) {
+          await storage.recordPosition(sessionLogId, epos);
+        }
+      } catch (error) {
+        console.error(`[RPi ${rpiId}] Error recording position:`, error);
+      }
+    };
+
+    ws.on("message", async function(data, isBinary) {
+      try {
+        // Binary messages carry camera frames without the base64/JSON wrapping
+        if (isBinary) {
+          const buffer = data as Buffer;
+
+          // Position reports start with an opcode byte that can never begin an ASCII station id
+          if (buffer[0] === POSITION_MESSAGE_OPCODE) {
+            if (buffer.length !== POSITION_MESSAGE_SIZE) {
+              console.warn(`[RPi ${rpiId}] Received malformed binary position message`);
+              return;
+            }
+            await handlePositionUpdate(buffer.readDoubleLE(9));
+            return;
+          }
+
+          if (buffer.length <= FRAME_HEADER_SIZE) {
+            console.warn(`[RPi ${rpiId}] Received binary frame without JPEG data`);
+            return;
+          }
+
+          // The frame number comes from the header so the UI can label frames the RPi no longer stamps
+          forwardCameraFrame(`data:image/jpeg;base64,${buffer.subarray(FRAME_HEADER_SIZE).toString('base64')}`,
+                             buffer.readUInt32LE(4));
+          return;
+        }
+
         const response = JSON.parse(data.toString());
 
         // Handle ping messages from the RPi (for latency measurement)
@@ -244,32 +357,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
 
         // Log position updates
         if (response.type === 'position_update') {
-          console.log(`[RPi ${rpiId}] Position update:`, response.epos);
-          
-          // Record position in database if there's an active session
-          try {
-            // Check if there's an active session for this RPi ID
-            const stations = await storage.getStations();
-            const station = stations.find(s => s.rpiId === rpiId && s.status === "in_use");
-            
-            if (station && station.currentSessionLogId) {
-              // Record the position data
-              await storage.recordPosition(station.currentSessionLogId, response.epos);
-            }
-          } catch (error) {
-            console.error(`[RPi ${rpiId}] Error recording position:`, error);
-          }
-          
-          // Forward position updates to relevant UI clients
-          for (const client of uiConnections.values()) {
-            if (client.ws.readyState === WebSocket.OPEN && client.rpiId === rpiId) {
-              client.ws.send(JSON.stringify({
-                type: 'position_update',
-                rpiId: rpiId,
-                epos: response.epos
-              }));
-            }
-          }
+          await handlePositionUpdate(response.epos);
           return;
         }
 
@@ -284,7 +372,9 @@ export async function registerRoutes(app: Express): Promise<Server> {
         if (response.type === 'register') {
           // Get the connection type from the message
           connectionType = response.connectionType || 'camera';
-          console.log(`[RPi ${rpiId}] Registered as ${connectionType} connection`);
+          recordPositions = !response.simulatedPosition;
+          console.log(`[RPi ${rpiId}] Registered as ${connectionType} connection` +
+                      (recordPositions ? '' : ' (simulated position, not recorded)'));
           
           // If this is a simulator connection without explicit type, register it as both camera and control
           if (rpiId.includes('RPI') && !response.connectionType) {
@@ -324,26 +414,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
             }
           }
 
-          // Create the message once to avoid excessive string operations
-          const frameMessage = JSON.stringify({
-            type: "camera_frame",
-            rpiId,
-            frame: frameToSend
-          });
-
-          let forwardCount = 0;
-          // Only send to UI clients that are subscribed to this RPi's feed
-          for (const client of uiConnections.values()) {
-            if (client.ws.readyState === WebSocket.OPEN && client.rpiId === rpiId) {
-              try {
-                client.ws.send(frameMessage);
-                forwardCount++;
-              } catch (error) {
-                console.error(`[RPi ${rpiId}] Error sending frame:`, error);
-              }
-            }
-          }
-
+          forwardCameraFrame(frameToSend, response.frameNumber);
 
         } else {
           // Handle RPi command responses - only send to relevant clients
@@ -10,13 +10,24 @@ import asyncio
 import websockets
 import json
 import base64
-from datetime import datetime
 import sys
 import os
 import time
 import random
 import logging
 
+# Rust JSON codec when installed; dumps stays str so messages go out as text frames
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+except ImportError:
+    json_dumps = json.dumps
+    json_loads = json.loads
+
 # ===== CONFIGURATION =====
 STATION_ID = sys.argv[1] if len(sys.argv) > 1 else "RPI1"
 SERVER_URL = f"wss://xeryonremotedemostation.replit.app/rpi/{STATION_ID}"
@@ -36,18 +47,78 @@ current_frame_number = 0
 shutdown_requested = False
 scanning_speed = 0.5  # mm per update interval
 
+# ===== TEST FRAME =====
+# A tiny 1x1 JPEG image (smallest possible valid JPEG), base64 encoded
+# This is just for testing; a real implementation would use a camera
+TINY_JPEG = '/9j/4AAQSkZJRgABAQEAYABgAAD/2wBDAAMCAgICAgMCAgIDAwMDBAYEBAQEBAgGBgUGCQgKCgkICQkKDA8MCgsOCwkJDRENDg8QEBEQCgwSExIQEw8QEBD/2wBDAQMDAwQDBAgEBAgQCwkLEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBD/wAARCAABAAEDASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYkNOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwD9U6KKKADpX//Z'
+
+# camera_frame JSON up to the frame number; only the counter and timestamp change per frame
+CAMERA_FRAME_PREFIX = ('{"type":"camera_frame","rpiId":' + json.dumps(STATION_ID) +
+                       ',"frame":"' + TINY_JPEG + '","frameNumber":')
+
 # ===== COMMAND PROCESSING =====
-async def handle_command(command_data):
-    """Process incoming commands with proper unit handling"""
+def do_step(direction, step_value):
+    """Move by one step immediately"""
     global current_position, target_position, scanning_direction
     
+    # Apply direction (up/down are not used in single-axis setup)
+    current_position += STEP_SIGN.get(direction, 0.0) * step_value
+        
+    # Limit position to reasonable range (-30mm to +30mm)
+    if current_position > 30:
+        current_position = 30
+    elif current_position < -30:
+        current_position = -30
+    target_position = None  # Step completed, no further movement
+    scanning_direction = None  # Stop any scanning
+
+def do_move(direction, step_value):
+    """Start continuous movement"""
+    global scanning_direction
+    scanning_direction = direction
+
+def do_move_right(direction, step_value):
+    global scanning_direction
+    scanning_direction = "right"
+
+def do_move_left(direction, step_value):
+    global scanning_direction
+    scanning_direction = "left"
+
+def do_stop(direction, step_value):
+    global scanning_direction, target_position
+    scanning_direction = None
+    target_position = None
+
+def do_home(direction, step_value):
+    global current_position, scanning_direction, target_position
+    current_position = 0.0
+    scanning_direction = None
+    target_position = None
+
+# Sign applied to a step for each direction; anything else leaves the position alone
+STEP_SIGN = {"right": 1.0, "left": -1.0}
+
+# One dict lookup per command instead of walking an if/elif chain
+COMMAND_HANDLERS = {
+    "step": do_step,
+    "move": do_move,
+    "move_right": do_move_right,
+    "move_left": do_move_left,
+    "stop": do_stop,
+    "home": do_home,
+}
+
+async def handle_command(command_data):
+    """Process incoming commands with proper unit handling"""
     command_type = command_data.get("command", "unknown")
     direction = command_data.get("direction", "none")
     step_size = command_data.get("stepSize")
     step_unit = command_data.get("stepUnit", "mm")
     
     # Log the received command
-    logger.info(f"Received command: {command_type}, direction: {direction}, stepSize: {step_size}, stepUnit: {step_unit}")
+    logger.info("Received command: %s, direction: %s, stepSize: %s, stepUnit: %s",
+                command_type, direction, step_size, step_unit)
     
     # Handle step unit conversion
     if step_size is not None and step_unit:
@@ -58,45 +129,14 @@ async def handle_command(command_data):
         elif step_unit == "nm":  # nano-meters
             step_value /= 1_000_000
             
-        logger.info(f"Converted step: {step_size} {step_unit} = {step_value} mm")
+        logger.info("Converted step: %s %s = %s mm", step_size, step_unit, step_value)
     else:
         step_value = 1.0  # Default 1mm
     
     # Process the command
-    if command_type == "step":
-        # Apply direction
-        if direction == "right":
-            current_position += step_value
-        elif direction == "left":
-            current_position -= step_value
-        elif direction == "up":  # Not used in single-axis setup
-            pass
-        elif direction == "down":  # Not used in single-axis setup
-            pass
-            
-        # Limit position to reasonable range (-30mm to +30mm)
-        current_position = max(-30, min(30, current_position))
-        target_position = None  # Step completed, no further movement
-        scanning_direction = None  # Stop any scanning
-        
-    elif command_type == "move":
-        # Start continuous movement
-        scanning_direction = direction
-        
-    elif command_type == "move_right":
-        scanning_direction = "right"
-        
-    elif command_type == "move_left":
-        scanning_direction = "left"
-        
-    elif command_type == "stop":
-        scanning_direction = None
-        target_position = None
-        
-    elif command_type == "home":
-        current_position = 0.0
-        scanning_direction = None
-        target_position = None
+    handler = COMMAND_HANDLERS.get(command_type)
+    if handler:
+        handler(direction, step_value)
     
     return {
         "type": "command_response",
@@ -104,7 +144,7 @@ async def handle_command(command_data):
         "command": command_type,
         "rpiId": STATION_ID,
         "epos": current_position,
-        "timestamp": datetime.now().isoformat()
+        "timestamp": int(time.time() * 1000)
     }
 
 # ===== UPDATE FUNCTIONS =====
@@ -131,27 +171,17 @@ async def update_position():
         "type": "position_update",
         "rpiId": STATION_ID,
         "epos": round(display_position, 3),
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": int(time.time() * 1000),
         "velocity": 0 if scanning_direction is None else (scanning_speed if scanning_direction == "right" else -scanning_speed)
     }
 
 async def generate_camera_frame():
-    """Generate a minimal camera frame for testing"""
+    """Generate a minimal camera frame for testing, already serialized as JSON"""
     global current_frame_number
     
-    # Create a tiny 1x1 JPEG image (smallest possible valid JPEG)
-    # This is just for testing; a real implementation would use a camera
-    tiny_jpeg = '/9j/4AAQSkZJRgABAQEAYABgAAD/2wBDAAMCAgICAgMCAgIDAwMDBAYEBAQEBAgGBgUGCQgKCgkICQkKDA8MCgsOCwkJDRENDg8QEBEQCgwSExIQEw8QEBD/2wBDAQMDAwQDBAgEBAgQCwkLEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBAQEBD/wAARCAABAAEDASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkKFhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYkNOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwD9U6KKKADpX//Z'
-    
     current_frame_number += 1
     
-    return {
-        "type": "camera_frame",
-        "rpiId": STATION_ID,
-        "frame": tiny_jpeg,  # Base64 encoded JPEG data
-        "frameNumber": current_frame_number,
-        "timestamp": datetime.now().isoformat()
-    }
+    return f'{CAMERA_FRAME_PREFIX}{current_frame_number},"timestamp":{int(time.time() * 1000)}}}'
 
 # ===== MAIN CONNECTION HANDLING =====
 async def heartbeat_loop(websocket):
@@ -161,7 +191,7 @@ async def heartbeat_loop(websocket):
             await websocket.send(json.dumps({
                 "type": "heartbeat",
                 "rpiId": STATION_ID,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": int(time.time() * 1000)
             }))
             logger.debug("Heartbeat sent")
             await asyncio.sleep(5.0)  # 5 second interval
@@ -175,7 +205,7 @@ async def position_update_loop(websocket):
         try:
             position_data = await update_position()
             await websocket.send(json.dumps(position_data))
-            print(f"Position update: {position_data['epos']} mm")
+            logger.debug("Position update: %s mm", position_data["epos"])
             await asyncio.sleep(EPOS_UPDATE_INTERVAL)
         except Exception as e:
             logger.error(f"Position update error: {str(e)}")
@@ -186,7 +216,7 @@ async def camera_frame_loop(websocket):
     while not shutdown_requested:
         try:
             frame_data = await generate_camera_frame()
-            await websocket.send(json.dumps(frame_data))
+            await websocket.send(frame_data)
             await asyncio.sleep(VIDEO_FRAME_INTERVAL)
         except Exception as e:
             logger.error(f"Camera frame error: {str(e)}")
@@ -217,49 +247,48 @@ async def main():
                 
                 logger.info(f"Connected to server as RPi {STATION_ID}")
                 
-                # Start update loops
-                tasks = [
-                    asyncio.create_task(heartbeat_loop(websocket)),
-                    asyncio.create_task(position_update_loop(websocket)),
-                    asyncio.create_task(camera_frame_loop(websocket))
-                ]
-                
-                # Handle incoming commands
+                # Start update loops and handle incoming commands; leaving the group
+                # (e.g. when the connection closes) cancels and awaits the update loops
                 try:
-                    while not shutdown_requested:
-                        message = await websocket.recv()
-                        try:
-                            data = json.loads(message)
+                    async with asyncio.TaskGroup() as tg:
+                        tg.create_task(heartbeat_loop(websocket))
+                        tg.create_task(position_update_loop(websocket))
+                        tg.create_task(camera_frame_loop(websocket))
+
+                        while not shutdown_requested:
+                            message = await websocket.recv()
+                            # The server only sends JSON objects; skip anything else without running the parser
+                            if message[:1] not in ("{", b"{"):
+                                logger.debug("Ignoring non-JSON message: %r", message[:32])
+                                continue
+                            try:
+                                data = json_loads(message)
                             
-                            if data.get("type") == "command":
-                                response = await handle_command(data)
-                                if response:
-                                    await websocket.send(json.dumps(response))
+                                if data.get("type") == "command":
+                                    response = await handle_command(data)
+                                    if response:
+                                        await websocket.send(json_dumps(response))
                                     
-                            elif data.get("type") == "ping":
-                                # Respond to ping with pong
-                                await websocket.send(json.dumps({
-                                    "type": "pong",
-                                    "timestamp": data.get("timestamp"),
-                                    "rpiId": STATION_ID
-                                }))
+                                elif data.get("type") == "ping":
+                                    try:
+                                        timestamp = data["timestamp"]
+                                    except KeyError:
+                                        # A pong without the ping's timestamp is useless for latency, skip it
+                                        logger.warning("Ping without timestamp: %s", message)
+                                        continue
+                                    # Respond to ping with pong
+                                    await websocket.send(json_dumps({
+                                        "type": "pong",
+                                        "timestamp": timestamp,
+                                        "rpiId": STATION_ID
+                                    }))
                                 
-                        except json.JSONDecodeError:
-                            logger.error(f"Invalid JSON: {message}")
+                            except json.JSONDecodeError:
+                                logger.error("Invalid JSON: %s", message)
                             
-                except websockets.exceptions.ConnectionClosed:
+                except* websockets.exceptions.ConnectionClosed:
                     logger.warning("Connection closed, attempting to reconnect...")
                 
-                # Cancel all tasks when connection is closed
-                for task in tasks:
-                    task.cancel()
-                
-                # Wait for tasks to complete
-                try:
-                    await asyncio.gather(*tasks, return_exceptions=True)
-                except asyncio.CancelledError:
-                    pass
-                
         except Exception as e:
             logger.error(f"Connection error: {str(e)}")
             